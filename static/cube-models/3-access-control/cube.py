@@ -1,124 +1,209 @@
-from cube import config 
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
 
+from cube import config
+
+# Shared read-only default for lookups that miss, so no empty dict is allocated per call
+_EMPTY = {}
+
+# Security settings for a single user. Frozen and slotted, since the mappings
+# are static and read on every request
+@dataclass(frozen=True, slots=True)
+class UserSecurity:
+    role: str
+    filter_type: str
+    show_pii: str = "false"
+    region_key: int | None = None
+    customer_keys: tuple[str, ...] = ()
+
+# User security mappings - in practice, these would come from your authentication system
 USER_SECURITY_MAPPINGS = {
     # YOUR USER - UPDATE WITH YOUR WORKSHOP EMAIL
-    "wdc-2025-999@example.com": {
-        "role": "global_admin",
-        "filter_type": "none",
-        "show_pii": "true"  # Admins can see PII data
-    },
+    "wdc-2025-999@example.com": UserSecurity(
+        role="global_admin",
+        filter_type="none",
+        show_pii="true"  # Admins can see PII data
+    ),
     
     # Global admin - sees everything
-    "admin@tpch.com": {
-        "role": "global_admin",
-        "filter_type": "none",
-        "show_pii": "true"  # Admins can see PII data
-    },
+    "admin@tpch.com": UserSecurity(
+        role="global_admin",
+        filter_type="none",
+        show_pii="true"  # Admins can see PII data
+    ),
 
     # Regional director - North America (Region 1)
-    "director_na@tpch.com": {
-        "role": "regional_director", 
-        "filter_type": "region",
-        "region_key": 1  # AMERICA
-    },
+    "director_na@tpch.com": UserSecurity(
+        role="regional_director",
+        filter_type="region",
+        region_key=1  # AMERICA
+    ),
     
     # Regional director - Europe (Region 3)
-    "director_eu@tpch.com": {
-        "role": "regional_director",
-        "filter_type": "region", 
-        "region_key": 3  # EUROPE
-    },
+    "director_eu@tpch.com": UserSecurity(
+        role="regional_director",
+        filter_type="region",
+        region_key=3  # EUROPE
+    ),
     
     # Sales rep - specific customers
-    "sarah_jones@tpch.com": {
-        "role": "sales_rep",
-        "filter_type": "customers",
-        "customer_keys": [1, 7, 13, 19, 25]  # 5 customers
-    },
+    "sarah_jones@tpch.com": UserSecurity(
+        role="sales_rep",
+        filter_type="customers",
+        customer_keys=("1", "7", "13", "19", "25")  # 5 customers
+    ),
     
     # Sales rep - different customers
-    "mike_chen@tpch.com": {
-        "role": "sales_rep",
-        "filter_type": "customers",
-        "customer_keys": [2, 8, 14, 20, 26, 27, 28]  # 7 customers
+    "mike_chen@tpch.com": UserSecurity(
+        role="sales_rep",
+        filter_type="customers",
+        customer_keys=("2", "8", "14", "20", "26", "27", "28")  # 7 customers
+    )
+}
+
+# Intern the user ids so lookups with an interned user_id match by identity
+USER_SECURITY_MAPPINGS = {sys.intern(k): v for k, v in USER_SECURITY_MAPPINGS.items()}
+
+def _validate_mappings():
+    # The masked() template compares show_pii against 'true' directly, so make sure
+    # every mapping uses the lowercase 'true' / 'false' strings
+    for user_id, user_security in USER_SECURITY_MAPPINGS.items():
+        if user_security.show_pii not in ('true', 'false'):
+            raise ValueError(f"Invalid show_pii value for {user_id}: {user_security.show_pii!r}")
+
+_validate_mappings()
+
+def _no_filter(user_security: UserSecurity):
+    # Global admin - no filters needed
+    return None
+
+def _region_filter(user_security: UserSecurity):
+    # Regional director - filter by region
+    return {
+        'member': 'customer_regions.region_key',
+        'operator': 'equals',
+        'values': [str(user_security.region_key)]
     }
+
+def _customers_filter(user_security: UserSecurity):
+    # Sales rep - filter by customer list
+    return {
+        'member': 'customers.customer_key',
+        'operator': 'in',
+        'values': list(user_security.customer_keys)
+    }
+
+# Filter builders for each user type
+_FILTER_BUILDERS = {
+    'none': _no_filter,
+    'region': _region_filter,
+    'customers': _customers_filter
+}
+
+# The mappings are static, so build each user's row-level filter once at import
+# instead of on every query. The filter objects are shared between queries and
+# must not be mutated. An unknown filter_type raises KeyError here rather than
+# silently granting unfiltered access.
+USER_FILTERS = {
+    user_id: _FILTER_BUILDERS[user_security.filter_type](user_security)
+    for user_id, user_security in USER_SECURITY_MAPPINGS.items()
+}
+
+def _build_customer_index() -> dict[str, frozenset[str]]:
+    # Inverted index of customer key -> sales reps that can see that customer
+    index = {}
+    for user_id, user_security in USER_SECURITY_MAPPINGS.items():
+        if user_security.filter_type == 'customers':
+            for customer_key in user_security.customer_keys:
+                index.setdefault(customer_key, set()).add(user_id)
+    return {k: frozenset(v) for k, v in index.items()}
+
+CUSTOMER_TO_USERS = _build_customer_index()
+
+# Impossible filter to return no data for users that are not found.
+# Like USER_FILTERS, the same object is appended to every denied query without
+# copying: Cube only reads the rewritten filters, so it must never be mutated.
+# 'values' stays a plain list since that is the shape Cube expects for filters.
+_DENY_FILTER = {
+    'member': 'customers.customer_key',
+    'operator': 'equals',
+    'values': ['-1']  # Non-existent customer
 }
 
 @config('query_rewrite')
 def query_rewrite(query: dict, ctx: dict) -> dict:
     # Get user from security context
-    user_id = ctx.get('securityContext', {}).get('user_id')
-    
-    # Look up user's security settings
-    user_security = USER_SECURITY_MAPPINGS.get(user_id, {})
-    
+    user_id = (ctx.get('securityContext') or _EMPTY).get('user_id')
+
     # Default to no access if user not found
-    if not user_security:
-        # Add impossible filter to return no data
-        query['filters'].append({
-            'member': 'customers.customer_key',
-            'operator': 'equals',
-            'values': ['-1']  # Non-existent customer
-        })
-        return query
-    
-    # Apply filters based on user type
-    filter_type = user_security.get('filter_type')
-    
-    if filter_type == 'none':
-        # Global admin - no filters needed
-        pass
-        
-    elif filter_type == 'region':
-        # Regional director - filter by region
-        query['filters'].append({
-            'member': 'customer_regions.region_key',
-            'operator': 'equals',
-            'values': [str(user_security['region_key'])]
-        })
-        
-    elif filter_type == 'customers':
-        # Sales rep - filter by customer list
-        query['filters'].append({
-            'member': 'customers.customer_key',
-            'operator': 'in',
-            'values': [str(ck) for ck in user_security['customer_keys']]
-        })
-    
+    user_filter = USER_FILTERS.get(user_id, _DENY_FILTER)
+    if user_filter is not None:
+        query['filters'].append(user_filter)
+
     return query
 
+# Security context defaults for anonymous users
+_ANON_CONTEXT = {
+    'show_pii': 'false',
+    'role': 'viewer'
+}
+
+@lru_cache(maxsize=256)
+def _resolve(user_id: str) -> tuple[str, str]:
+    # Look up user security settings, returning (show_pii, role)
+    user_security = USER_SECURITY_MAPPINGS.get(user_id)
+    if user_security is None:
+        return ('false', 'viewer')
+    return (user_security.show_pii, user_security.role)
+
 @config('extend_context')
 def extend_context(req: dict) -> dict:
-    # Check if securityContext exists, skip extending context if not
-    if 'securityContext' not in req:
+    # Get user from security context - handle both React app and D3 formats,
+    # skip extending context if it doesn't exist
+    security_context = req.get('securityContext')
+    if security_context is None:
         return req
-
-    # Get user from security context 
-    security_context = req.get('securityContext', {})
-    
-    # If user_id is not in the securityContext, extract it from cubeCloud.username
-    if 'user_id' not in security_context:
-        if 'cubeCloud' in security_context:
-            # Update the user_id in the security context
-            req['securityContext']['user_id'] = security_context.get('cubeCloud', {}).get('username')
     
-    user_id = security_context.get('user_id', 'anonymous')
+    # If D3 format (has cubeCloud key), extract username from cubeCloud.username
+    if 'cubeCloud' in security_context:
+        user_id = security_context.get('cubeCloud', _EMPTY).get('username')
+        # Update the user_id in the security context
+        security_context['user_id'] = user_id
+    else:
+        # For React app format, use existing user_id
+        user_id = security_context.get('user_id', 'anonymous')
+
+    # Anonymous users always get the viewer defaults, skip the lookup
+    if user_id is None or user_id == 'anonymous':
+        security_context.update(_ANON_CONTEXT)
+        return req
     
     # Look up user security settings
-    user_security = USER_SECURITY_MAPPINGS.get(user_id, {})
+    show_pii, role = _resolve(user_id)
     
-    # Set the show_pii flag in security context for template function
-    req['securityContext']['show_pii'] = user_security.get('show_pii', 'false')
-    req['securityContext']['role'] = user_security.get('role', 'viewer')  # Add role
+    # Set both show_pii and role in security context
+    security_context['show_pii'] = show_pii
+    security_context['role'] = role  # Add role
 
     return req
 
+# Precompute the interned cache keys for every known role / PII combination
+_APP_IDS = {
+    (role, show_pii): sys.intern(f"CUBE_APP_{role}_{show_pii}")
+    for role in {user_security.role for user_security in USER_SECURITY_MAPPINGS.values()} | {'viewer'}
+    for show_pii in ('true', 'false')
+}
+
 @config('context_to_app_id')
 def context_to_app_id(ctx: dict) -> str:
-    security_context = ctx.get('securityContext', {})
-    show_pii = security_context.get('show_pii', 'false')
-    role = security_context.get('role', 'viewer')
+    # Requests without a security context use the anonymous defaults
+    security_context = ctx.get('securityContext') or _ANON_CONTEXT
+    key = (security_context.get('role', 'viewer'), security_context.get('show_pii', 'false'))
     
     # Create a cache key that includes both role and PII access
     # This ensures users with different roles get separate cached data models
-    return f"CUBE_APP_{role}_{show_pii}"
\ No newline at end of file
+    app_id = _APP_IDS.get(key)
+    if app_id is None:
+        app_id = f"CUBE_APP_{key[0]}_{key[1]}"
+    return app_id
\ No newline at end of file
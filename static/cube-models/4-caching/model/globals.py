@@ -5,15 +5,9 @@ template = TemplateContext()
 @template.function('masked')
 def masked(sql, security_context):
   
-  # Check if security_context is None or empty
-  if not security_context:
-    return "'--- masked ---'"
-  
-  # Safely get the show_pii value
-  show_pii = security_context.get('show_pii', 'false')
-  
-  # Use explicit string comparison and handle case sensitivity
-  if show_pii.lower() == 'true':
+  # show_pii is normalized to 'true' / 'false' by extend_context,
+  # so a missing security_context or any other value is masked
+  if (security_context or {}).get('show_pii') == 'true':
     return sql
-  else:
-    return "'--- masked ---'"
\ No newline at end of file
+
+  return "'--- masked ---'"
\ No newline at end of file